@@ -59,6 +59,28 @@ struct NewReceiptItemResponse: Codable {
     var item_id: Int
 }
 
+// one entry of POST /receipts/<id>/items/batch, op is "create", "update" or "delete"
+struct ReceiptItemOperation: Codable {
+    var op: String
+    var id: Int?
+    var description: String?
+    var price: Double?
+    var category: Int?
+}
+
+struct ReceiptItemBatchRequest: Codable {
+    var operations: [ReceiptItemOperation]
+}
+
+struct ReceiptItemOperationResult: Codable {
+    var op: String
+    var id: Int
+}
+
+struct ReceiptItemBatchResponse: Codable {
+    var items: [ReceiptItemOperationResult]
+}
+
 struct ReceiptItem: Codable, Identifiable {
     // This id is generated locally and won't be decoded from the JSON.
     var id: Int // UUID = UUID() // HAVE TO GET + REASSIGN THIS VALUE WHEN RECEIPT ITEM IS CREATED
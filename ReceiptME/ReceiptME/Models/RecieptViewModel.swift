@@ -130,6 +130,16 @@ class ReceiptViewModel: ObservableObject {
     }
     
     
+    func batchUpdateReceiptItems(_ operations: [ReceiptItemOperation], receipt_id: Int, completion: @escaping (Result<[ReceiptItemOperationResult], Error>) -> Void) {
+        
+        APIService.shared.batchUpdateReceiptItems(operations, receipt_id: receipt_id) { result in
+            DispatchQueue.main.async {
+                completion(result)
+            }
+        }
+    }
+    
+    
     func getCategories(_ year: Int?, month: Int?, completion: @escaping (Result<[Category], Error>) -> Void) {
         
         APIService.shared.getCategories(year: year, month: month) {
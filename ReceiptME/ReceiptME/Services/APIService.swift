@@ -331,6 +331,41 @@ class APIService {
             }
     }
     
+    // MARK: - Batch Update Receipt Items
+    // Applies all operations in one request (and one transaction on the backend)
+    func batchUpdateReceiptItems(_ operations: [ReceiptItemOperation], receipt_id: Int, completion: @escaping (Result<[ReceiptItemOperationResult], Error>) -> Void) {
+        guard let url = URL(string: "\(baseURL)/receipts/\(receipt_id)/items/batch") else {
+            completion(.failure(APIError.invalidURL))
+            return
+        }
+        
+        do {
+            let jsonData = try JSONEncoder().encode(ReceiptItemBatchRequest(operations: operations))
+            let request = createAuthorizedRequest(url: url, method: "POST", contentType: "application/json", body: jsonData)
+            
+            URLSession.shared.dataTask(with: request) { data, response, error in
+                if let error = error {
+                    completion(.failure(error))
+                    return
+                }
+                
+                guard let data = data else {
+                    completion(.failure(APIError.noData))
+                    return
+                }
+                
+                do {
+                    let responseData = try JSONDecoder().decode(ReceiptItemBatchResponse.self, from: data)
+                    completion(.success(responseData.items))
+                } catch {
+                    completion(.failure(error))
+                }
+            }.resume()
+        } catch {
+            completion(.failure(error))
+        }
+    }
+    
     // MARK: - Delete Receipt
     func deleteReceipt(receiptId: Int, completion: @escaping (Result<Void, Error>) -> Void) {
         guard let url = URL(string: "\(baseURL)/receipts/\(receiptId)") else {
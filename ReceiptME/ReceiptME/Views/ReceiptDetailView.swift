@@ -407,7 +407,7 @@ extension ReceiptDetailView {
 
     }
     
-    /// Bulk‑assign a single category to every line item, by calling your item‑level API on each.
+    /// Bulk‑assign a single category to every line item, in a single batch request.
     private func applyCategoryToAll(_ category: Category) {
         guard let details = details else { return }
 
@@ -418,13 +418,14 @@ extension ReceiptDetailView {
             return copy
         }
 
-        // 2) Push that change to *each* line‑item via the same API you already use
-        for item in editableItems {
-            viewModel.updateReceiptItem(item,
-                                       receipt_id: details.id) { result in
-                if case .failure(let error) = result {
-                    print("Failed to update item \(item.id): \(error)")
-                }
+        // 2) Push every line‑item change in one round trip
+        // Unsaved items still have a negative placeholder id, they get the category when they are saved
+        let operations = editableItems.filter { $0.id > 0 }.map { item in
+            ReceiptItemOperation(op: "update", id: item.id, description: item.description, price: item.price, category: item.category)
+        }
+        viewModel.batchUpdateReceiptItems(operations, receipt_id: details.id) { result in
+            if case .failure(let error) = result {
+                print("Failed to update items: \(error)")
             }
         }
 
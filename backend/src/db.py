@@ -2,6 +2,7 @@ import psycopg
 import random
 import string
 import os
+from datetime import date
 
 def connect():
 	try:
@@ -17,6 +18,62 @@ def init():
 		cur.execute("CREATE TABLE IF NOT EXISTS receipts (id SERIAL PRIMARY KEY, owner_id INTEGER REFERENCES users, date DATE, merchant VARCHAR(255), merchant_address TEXT, merchant_domain VARCHAR(255), payment_method VARCHAR(255), tax DOUBLE PRECISION, clean BOOLEAN)")
 		cur.execute("CREATE TABLE IF NOT EXISTS budget_categories (id SERIAL PRIMARY KEY, user_id INTEGER REFERENCES users, name TEXT, monthly_goal DOUBLE PRECISION)")
 		cur.execute("CREATE TABLE IF NOT EXISTS receipt_items (id SERIAL PRIMARY KEY, receipt_id INTEGER REFERENCES receipts, description VARCHAR(255), price DOUBLE PRECISION, bbox_left INTEGER, bbox_top INTEGER, bbox_right INTEGER, bbox_bottom INTEGER, category INTEGER REFERENCES budget_categories)")
+		cur.execute("CREATE INDEX IF NOT EXISTS receipts_owner_date ON receipts (owner_id, date)")
+		cur.execute("CREATE INDEX IF NOT EXISTS receipt_items_receipt ON receipt_items (receipt_id)")
+
+		# spend_rollup holds item spend per user, month, category and merchant. Triggers on receipts and
+		# receipt_items mark the affected (user, month) pairs in spend_rollup_dirty, and those months are
+		# recomputed the next time the user's spend is read (see refresh_spend_rollup). The triggers upsert
+		# rather than DO NOTHING so that a writer locks an existing dirty row and serializes with a refresh.
+		# Both sides lock a user's dirty rows in ascending month order so that they cannot deadlock.
+		cur.execute("SELECT to_regclass('spend_rollup') IS NULL")
+		rollup_is_new = cur.fetchone()[0]
+		cur.execute("CREATE TABLE IF NOT EXISTS spend_rollup (user_id INTEGER REFERENCES users, month DATE, category INTEGER, merchant VARCHAR(255), total DOUBLE PRECISION)")
+		cur.execute("CREATE INDEX IF NOT EXISTS spend_rollup_user_month ON spend_rollup (user_id, month)")
+		cur.execute("CREATE TABLE IF NOT EXISTS spend_rollup_dirty (user_id INTEGER REFERENCES users, month DATE, PRIMARY KEY (user_id, month))")
+		cur.execute("""
+			CREATE OR REPLACE FUNCTION mark_receipt_spend_dirty() RETURNS trigger AS $$
+			DECLARE
+				old_month DATE;
+				new_month DATE;
+			BEGIN
+				IF TG_OP <> 'INSERT' AND OLD.owner_id IS NOT NULL AND OLD.date IS NOT NULL THEN
+					old_month := date_trunc('month', OLD.date)::date;
+				END IF;
+				IF TG_OP <> 'DELETE' AND NEW.owner_id IS NOT NULL AND NEW.date IS NOT NULL THEN
+					new_month := date_trunc('month', NEW.date)::date;
+				END IF;
+
+				IF old_month IS NOT NULL AND (new_month IS NULL OR old_month <= new_month) THEN
+					INSERT INTO spend_rollup_dirty (user_id, month) VALUES (OLD.owner_id, old_month) ON CONFLICT (user_id, month) DO UPDATE SET month = EXCLUDED.month;
+				END IF;
+				IF new_month IS NOT NULL THEN
+					INSERT INTO spend_rollup_dirty (user_id, month) VALUES (NEW.owner_id, new_month) ON CONFLICT (user_id, month) DO UPDATE SET month = EXCLUDED.month;
+				END IF;
+				IF old_month IS NOT NULL AND new_month IS NOT NULL AND old_month > new_month THEN
+					INSERT INTO spend_rollup_dirty (user_id, month) VALUES (OLD.owner_id, old_month) ON CONFLICT (user_id, month) DO UPDATE SET month = EXCLUDED.month;
+				END IF;
+				RETURN NULL;
+			END;
+			$$ LANGUAGE plpgsql
+		""")
+		cur.execute("""
+			CREATE OR REPLACE FUNCTION mark_receipt_item_spend_dirty() RETURNS trigger AS $$
+			BEGIN
+				IF TG_OP <> 'INSERT' THEN
+					INSERT INTO spend_rollup_dirty (user_id, month) SELECT owner_id, date_trunc('month', date)::date FROM receipts WHERE id = OLD.receipt_id AND owner_id IS NOT NULL AND date IS NOT NULL ON CONFLICT (user_id, month) DO UPDATE SET month = EXCLUDED.month;
+				END IF;
+				IF TG_OP <> 'DELETE' THEN
+					INSERT INTO spend_rollup_dirty (user_id, month) SELECT owner_id, date_trunc('month', date)::date FROM receipts WHERE id = NEW.receipt_id AND owner_id IS NOT NULL AND date IS NOT NULL ON CONFLICT (user_id, month) DO UPDATE SET month = EXCLUDED.month;
+				END IF;
+				RETURN NULL;
+			END;
+			$$ LANGUAGE plpgsql
+		""")
+		cur.execute("CREATE OR REPLACE TRIGGER receipts_spend_dirty AFTER INSERT OR UPDATE OR DELETE ON receipts FOR EACH ROW EXECUTE FUNCTION mark_receipt_spend_dirty()")
+		cur.execute("CREATE OR REPLACE TRIGGER receipt_items_spend_dirty AFTER INSERT OR UPDATE OR DELETE ON receipt_items FOR EACH ROW EXECUTE FUNCTION mark_receipt_item_spend_dirty()")
+		if rollup_is_new:
+			cur.execute("INSERT INTO spend_rollup_dirty (user_id, month) SELECT DISTINCT owner_id, date_trunc('month', date)::date FROM receipts WHERE owner_id IS NOT NULL AND date IS NOT NULL ON CONFLICT DO NOTHING")
 
 def login_user(email, full_name):
 	session_token = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(32))
@@ -42,10 +99,25 @@ def check_session_token(token):
 			return None, False
 		return user[0], True
 
+def refresh_spend_rollup(cur, user_id):
+	cur.execute("SELECT month FROM spend_rollup_dirty WHERE user_id = %s ORDER BY month FOR UPDATE", (user_id,))
+	months = [row[0] for row in cur.fetchall()]
+	if len(months) == 0:
+		return
+
+	cur.execute("DELETE FROM spend_rollup_dirty WHERE user_id = %s AND month = ANY(%s)", (user_id, months))
+
+	cur.execute("DELETE FROM spend_rollup WHERE user_id = %s AND month = ANY(%s)", (user_id, months))
+	cur.execute(
+		"INSERT INTO spend_rollup (user_id, month, category, merchant, total) SELECT receipts.owner_id, date_trunc('month', receipts.date)::date, receipt_items.category, receipts.merchant, SUM(receipt_items.price) FROM receipt_items JOIN receipts ON receipts.id = receipt_items.receipt_id WHERE receipts.owner_id = %s AND receipts.date >= %s AND receipts.date < %s::date + INTERVAL '1 month' AND date_trunc('month', receipts.date)::date = ANY(%s) GROUP BY 1, 2, 3, 4",
+		(user_id, min(months), max(months), months)
+	)
+
 def get_budget_categories(user_id, year, month):
 	with connect() as conn:
 		cur = conn.cursor()
-		cur.execute("SELECT id, name, monthly_goal, (SELECT SUM(price) FROM receipt_items JOIN receipts ON receipts.id = receipt_items.receipt_id WHERE receipt_items.category = budget_categories.id AND receipts.owner_id = budget_categories.user_id AND EXTRACT(YEAR FROM receipts.date) = %s AND EXTRACT(MONTH FROM receipts.date) = %s) as month_spend FROM budget_categories WHERE user_id = %s", (year, month, user_id))
+		refresh_spend_rollup(cur, user_id)
+		cur.execute("SELECT id, name, monthly_goal, (SELECT SUM(total) FROM spend_rollup WHERE spend_rollup.user_id = budget_categories.user_id AND spend_rollup.category = budget_categories.id AND spend_rollup.month = %s) as month_spend FROM budget_categories WHERE user_id = %s", (date(year, month, 1), user_id))
 		rows = cur.fetchall()
 		categories = []
 		for row in rows:
@@ -57,6 +129,40 @@ def get_budget_categories(user_id, year, month):
 			})
 		return categories
 
+def get_spend_analytics(user_id, start_month, end_month):
+	with connect() as conn:
+		cur = conn.cursor()
+		refresh_spend_rollup(cur, user_id)
+
+		cur.execute(
+			"SELECT spend_rollup.month, spend_rollup.category, budget_categories.name, SUM(spend_rollup.total) FROM spend_rollup LEFT JOIN budget_categories ON budget_categories.id = spend_rollup.category AND budget_categories.user_id = spend_rollup.user_id WHERE spend_rollup.user_id = %s AND spend_rollup.month BETWEEN %s AND %s GROUP BY spend_rollup.month, spend_rollup.category, budget_categories.name ORDER BY spend_rollup.month, spend_rollup.category",
+			(user_id, start_month, end_month)
+		)
+		by_category = []
+		for row in cur.fetchall():
+			by_category.append({
+				"month": row[0].strftime("%Y-%m"),
+				"category": row[1],
+				"name": row[2],
+				"total": round(row[3], 2) if row[3] is not None else 0.00
+			})
+
+		cur.execute(
+			"SELECT merchant, SUM(total) AS merchant_total FROM spend_rollup WHERE user_id = %s AND month BETWEEN %s AND %s GROUP BY merchant ORDER BY merchant_total DESC",
+			(user_id, start_month, end_month)
+		)
+		by_merchant = []
+		for row in cur.fetchall():
+			by_merchant.append({
+				"merchant": row[0],
+				"total": round(row[1], 2) if row[1] is not None else 0.00
+			})
+
+		return {
+			"categories": by_category,
+			"merchants": by_merchant
+		}
+
 def create_category(user_id, name, monthly_goal):
 	with connect() as conn:
 		cur = conn.cursor()
@@ -215,3 +321,44 @@ def delete_receipt_item(receipt_id, item_id):
 	with connect() as conn:
 		cur = conn.cursor()
 		cur.execute("DELETE FROM receipt_items WHERE id = %s AND receipt_id = %s", (item_id, receipt_id))
+
+def apply_receipt_item_changes(receipt_id, user_id, operations):
+	with connect() as conn:
+		cur = conn.cursor()
+
+		cur.execute("SELECT owner_id FROM receipts WHERE id = %s FOR UPDATE", (receipt_id,))
+		receipt = cur.fetchone()
+		if receipt is None:
+			return None, None
+		owner_id = receipt[0]
+		if owner_id != user_id:
+			return owner_id, None
+
+		category_ids = list(set(op["category"] for op in operations if op["category"] is not None))
+		if len(category_ids) > 0:
+			cur.execute("SELECT COUNT(*) FROM budget_categories WHERE user_id = %s AND id = ANY(%s)", (user_id, category_ids))
+			if cur.fetchone()[0] != len(category_ids):
+				return owner_id, None
+
+		results = []
+		for op in operations:
+			if op["op"] == "create":
+				cur.execute("INSERT INTO receipt_items (receipt_id, description, price, category) VALUES (%s, %s, %s, %s) RETURNING id", (receipt_id, op["description"], op["price"], op["category"]))
+				item_id = cur.fetchone()[0]
+			elif op["op"] == "update":
+				cur.execute("UPDATE receipt_items SET price = %s, description = %s, category = %s WHERE id = %s AND receipt_id = %s", (op["price"], op["description"], op["category"], op["id"], receipt_id))
+				item_id = op["id"]
+			else:
+				cur.execute("DELETE FROM receipt_items WHERE id = %s AND receipt_id = %s", (op["id"], receipt_id))
+				item_id = op["id"]
+
+			if cur.rowcount != 1:
+				conn.rollback()
+				return owner_id, None
+
+			results.append({
+				"op": op["op"],
+				"id": item_id
+			})
+
+		return owner_id, results
@@ -0,0 +1,264 @@
+from openai import OpenAI
+import openai
+import threading
+import random
+import time
+import json
+import re
+import os
+from datetime import datetime
+
+# OPENAI_BASE_URL can point the client at a local fake server
+TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "20"))
+DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE_SECONDS", "45"))
+MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", "0.5"))
+MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", "4"))
+MODEL = os.environ.get("LLM_MODEL", "gpt-4o-mini")
+
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+client = OpenAI(max_retries=0)
+in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+usage_lock = threading.Lock()
+usage = {
+	"calls": 0,
+	"prompt_tokens": 0,
+	"completion_tokens": 0,
+	"fallbacks": 0
+}
+
+SYSTEM_PROMPT = "You will be provided with the OCR extracted text from a receipt with line numbers. Parse the text and provide the requested JSON formatted output. OCR outputs are inherently messy, so extract only the relevant information. For the individual receipt items, do not use information from more than one line to construct an item entry."
+
+RESPONSE_FORMAT = {
+	"type": "json_schema",
+	"json_schema": {
+		"name": "payment_receipt",
+		"strict": False,
+		"schema": {
+			"type": "object",
+			"properties": {
+				"name": {
+					"type": "string",
+					"description": "Merchant name"
+				},
+				"date": {
+					"type": "string",
+					"description": "MM-DD-YYYY"
+				},
+				"merchant_address": {
+					"type": "string"
+				},
+				"merchant_website": {
+					"type": "string",
+					"description": "Domain name"
+				},
+				"items": {
+					"type": "array",
+					"items": {
+						"type": "object",
+						"properties": {
+							"description": {
+								"type": "string",
+								"description": "Short item name, junk words removed, normalized capitalization"
+							},
+							"cost": {
+								"type": "number"
+							},
+							"line_number": {
+								"type": "number",
+								"description": "Line the item was read from"
+							}
+						},
+						"required": [
+							"description",
+							"cost",
+							"line_number"
+						],
+						"additionalProperties": False
+					}
+				},
+				"subtotal": {
+					"type": "number",
+					"description": "Total before taxes and fees"
+				},
+				"total": {
+					"type": "number",
+					"description": "Amount due including taxes and fees"
+				},
+				"payment_method": {
+					"type": "string",
+					"description": "Card network and number, or payment type"
+				}
+			},
+			"required": [
+				"items",
+				"subtotal",
+				"total"
+			],
+			"additionalProperties": False
+		}
+	}
+}
+
+PRICE_RE = re.compile(r"(-?\d+[.,]\d{2})\s*[A-Za-z]?\s*$")
+DATE_RE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})\b")
+NOT_ITEM_WORDS = ["total", "tax", "change", "cash", "tender", "balance", "due", "visa", "mastercard", "amex", "discover", "debit", "credit", "card", "payment", "savings"]
+PAYMENT_WORDS = ["visa", "mastercard", "amex", "discover", "debit", "credit", "cash"]
+
+# Returns (line number, text) pairs for the lines worth sending. Line numbers are the indices into
+# receipt_lines so that item line_numbers can still be mapped back to bounding boxes.
+def compact_lines(receipt_lines):
+	lines = []
+	for i, line in enumerate(receipt_lines):
+		text = " ".join(line["text"].split())
+		if sum(c.isalnum() for c in text) < 2:
+			continue
+		lines.append((i, text))
+	return lines
+
+def parse_receipt(receipt_lines):
+	lines = compact_lines(receipt_lines)
+	message = "\n".join(f"Line {i}: {text}" for i, text in lines)
+
+	deadline = time.monotonic() + DEADLINE_SECONDS
+	if not in_flight.acquire(timeout=DEADLINE_SECONDS):
+		print("llm: too many requests in flight, using fallback parser")
+		return fallback_parse(lines)
+
+	try:
+		content = request_completion(message, deadline)
+	finally:
+		in_flight.release()
+
+	if content is None:
+		return fallback_parse(lines)
+
+	try:
+		return json.loads(content)
+	except:
+		print("llm: response was not valid JSON, using fallback parser")
+		return fallback_parse(lines)
+
+def request_completion(message, deadline):
+	for attempt in range(MAX_ATTEMPTS):
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			break
+
+		try:
+			res = client.with_options(timeout=min(TIMEOUT_SECONDS, remaining)).chat.completions.create(
+				model=MODEL,
+				messages=[{
+					"role": "system",
+					"content": [{
+						"type": "text",
+						"text": SYSTEM_PROMPT
+					}]
+				}, {
+					"role": "user",
+					"content": [{
+						"type": "text",
+						"text": message
+					}]
+				}],
+				response_format=RESPONSE_FORMAT
+			)
+		except RETRYABLE_ERRORS as e:
+			print(f"llm: attempt {attempt + 1} failed: {e}")
+			if attempt == MAX_ATTEMPTS - 1:
+				break
+			# full jitter, never sleeping past the deadline
+			delay = random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt)
+			time.sleep(max(0, min(delay, deadline - time.monotonic())))
+			continue
+		except openai.APIError as e:
+			print(f"llm: request failed: {e}")
+			return None
+
+		record_usage(res.usage)
+		return res.choices[0].message.content
+
+	print("llm: out of attempts or time, using fallback parser")
+	return None
+
+def record_usage(res_usage):
+	with usage_lock:
+		usage["calls"] += 1
+		if res_usage is not None:
+			usage["prompt_tokens"] += res_usage.prompt_tokens
+			usage["completion_tokens"] += res_usage.completion_tokens
+		print(f"llm usage: {usage}")
+
+def fallback_parse(lines):
+	with usage_lock:
+		usage["fallbacks"] += 1
+		print(f"llm usage: {usage}")
+
+	data = {
+		"name": "",
+		"date": None,
+		"merchant_address": "",
+		"merchant_website": "",
+		"payment_method": "",
+		"items": [],
+		"subtotal": None,
+		"total": None,
+		# heuristic results always need review, save_receipt stores them as not clean
+		"fallback": True
+	}
+
+	for i, text in lines:
+		lower = text.lower()
+
+		if data["name"] == "" and any(c.isalpha() for c in text):
+			data["name"] = text
+
+		if data["date"] is None:
+			for date_match in DATE_RE.finditer(text):
+				month, day, year = date_match.groups()
+				if len(year) == 2:
+					year = "20" + year
+				candidate = f"{int(month):02d}-{int(day):02d}-{year}"
+				try:
+					datetime.strptime(candidate, "%m-%d-%Y")
+				except ValueError:
+					continue
+				data["date"] = candidate
+				break
+
+		if data["payment_method"] == "":
+			for word in PAYMENT_WORDS:
+				if word in lower:
+					data["payment_method"] = word.capitalize()
+					break
+
+		price_match = PRICE_RE.search(text)
+		if price_match is None:
+			continue
+		price = float(price_match.group(1).replace(",", "."))
+
+		if "subtotal" in lower or "sub total" in lower:
+			if data["subtotal"] is None:
+				data["subtotal"] = price
+		elif "total" in lower:
+			if data["total"] is None:
+				data["total"] = price
+		elif not any(word in lower for word in NOT_ITEM_WORDS):
+			description = text[:price_match.start()].strip()
+			if description != "":
+				data["items"].append({
+					"description": description.capitalize(),
+					"cost": price,
+					"line_number": i
+				})
+
+	if data["date"] is None:
+		data["date"] = datetime.now().strftime("%m-%d-%Y")
+	if data["subtotal"] is None:
+		data["subtotal"] = data["total"] if data["total"] is not None else round(sum(item["cost"] for item in data["items"]), 2)
+	if data["total"] is None:
+		data["total"] = data["subtotal"]
+
+	return data
@@ -1,17 +1,14 @@
 import db
+import llm
 import bottle
 from google.oauth2 import id_token as google_auth
 from google.auth.transport import requests as google_requests
 from PIL import Image
 import pytesseract
-from openai import OpenAI
-import json
 import io
 import os
 from datetime import datetime
 
-openai_client = OpenAI()
-
 @bottle.post("/auth/google/token")
 def	google_auth_token():
 	data = bottle.request.json
@@ -47,13 +44,49 @@ def get_budget_for_month(year, month):
 	except:
 		bottle.response.status = 404
 		return "Not Found"
-		
+
+	if year < 1 or year > 9999 or month < 1 or month > 12:
+		bottle.response.status = 404
+		return "Not Found"
+
 	categories = db.get_budget_categories(user_id, year, month)
 
 	return {
 		"categories": categories
 	}
 
+@bottle.get("/analytics")
+def get_analytics():
+	user_id, ok = db.check_session_token(bottle.request.get_header("Authorization"))
+	if not ok:
+		bottle.response.status = 403
+		return "Unauthorized"
+
+	# start and end are inclusive months in the format YYYY-MM, defaulting to the last 12 months
+	now = datetime.now()
+	end = bottle.request.query.get("end") or f"{now.year}-{now.month:02d}"
+	start = bottle.request.query.get("start") or (f"{now.year - 1}-{now.month + 1:02d}" if now.month < 12 else f"{now.year}-01")
+
+	try:
+		start_month = datetime.strptime(start, "%Y-%m").date()
+		end_month = datetime.strptime(end, "%Y-%m").date()
+	except:
+		bottle.response.status = 400
+		return "start and end should be in the format YYYY-MM"
+
+	if start_month > end_month:
+		bottle.response.status = 400
+		return "start should not be after end"
+
+	analytics = db.get_spend_analytics(user_id, start_month, end_month)
+
+	return {
+		"start": start_month.strftime("%Y-%m"),
+		"end": end_month.strftime("%Y-%m"),
+		"categories": analytics["categories"],
+		"merchants": analytics["merchants"]
+	}
+
 @bottle.post("/categories")
 def create_category():
 	user_id, ok = db.check_session_token(bottle.request.get_header("Authorization"))
@@ -261,6 +294,76 @@ def delete_receipt_item(receipt_id, item_id):
 	bottle.response.status = 200
 	return
 
+@bottle.post("/receipts/<receipt_id>/items/batch")
+def batch_edit_receipt_items(receipt_id):
+	user_id, ok = db.check_session_token(bottle.request.get_header("Authorization"))
+	if not ok:
+		bottle.response.status = 403
+		return "Unauthorized"
+
+	req_data = bottle.request.json
+	if req_data is None or not isinstance(req_data.get("operations"), list):
+		bottle.response.status = 400
+		return "Bad request"
+
+	operations = []
+	for op in req_data["operations"]:
+		if not isinstance(op, dict) or op.get("op") not in ("create", "update", "delete"):
+			bottle.response.status = 400
+			return "Bad request"
+
+		item_id = op.get("id")
+		if op["op"] != "create" and (not isinstance(item_id, int) or isinstance(item_id, bool)):
+			bottle.response.status = 400
+			return "Bad request"
+
+		price = None
+		if op["op"] != "delete":
+			if "price" not in op or "description" not in op:
+				bottle.response.status = 400
+				return "Bad request"
+
+			if not isinstance(op["description"], str) or len(op["description"]) > 255:
+				bottle.response.status = 400
+				return "description should be a string of at most 255 characters"
+
+			try:
+				price = float(op["price"])
+			except:
+				bottle.response.status = 400
+				return "price should be a double"
+
+		category_id = op.get("category")
+		if category_id is not None and (not isinstance(category_id, int) or isinstance(category_id, bool)):
+			bottle.response.status = 400
+			return "Bad request"
+
+		operations.append({
+			"op": op["op"],
+			"id": item_id,
+			"price": price,
+			"description": op.get("description"),
+			"category": category_id,
+		})
+
+	owner_id, items = db.apply_receipt_item_changes(receipt_id, user_id, operations)
+	if owner_id is None:
+		bottle.response.status = 404
+		return "Not found"
+
+	if owner_id != user_id:
+		bottle.response.status = 401
+		return "Forbidden"
+
+	if items is None:
+		bottle.response.status = 404
+		return "Not found"
+
+	bottle.response.status = 200
+	return {
+		"items": items
+	}
+
 
 @bottle.get("/receipts/<receipt_id>/scan.png")
 def get_receipt_img(receipt_id):
@@ -324,101 +427,8 @@ def add_receipt_auto():
 	img = Image.open(bottle.request.body)
 	receipt_lines = get_receipt_lines(img)
 
-	message = "\n".join(f"Line {i}: {line['text']}" for i, line in enumerate(receipt_lines))
-
-	res = openai_client.chat.completions.create(
-		model="gpt-4o-mini",
-		messages=[{
-			"role": "system",
-
-			"content": [{
-				"type": "text",
-				"text": "You will be provided with the OCR extracted text from a receipt with line numbers. Parse the text and provide the requested JSON formatted output. OCR outputs are inherently messy, so extract only the relevant information. For the individual receipt items, do not use information from more than one line to construct an item entry."
-			}]
-		}, {
-			"role": "user",
-			"content": [{
-				"type": "text",
-				"text": message
-			}]
-		}],
-		response_format={
-			"type": "json_schema",
-			"json_schema": {
-				"name": "payment_receipt",
-				"strict": False,
-				"schema": {
-					"type": "object",
-					"properties": {
-						"name": {
-							"type": "string",
-							"description": "Name of the merchant"
-						},
-						"date": {
-							"type": "string",
-							"description": "The date on the receipt, in the format MM-DD-YYYY"
-						},
-						"merchant_address": {
-							"type": "string",
-							"description": "Address of the merchant"
-						},
-						"merchant_website": {
-							"type": "string",
-							"description": "Merchant's domain name"
-						},
-						"items": {
-							"type": "array",
-							"description": "List of items included in the payment receipt.",
-							"items": {
-								"type": "object",
-								"properties": {
-									"description": {
-										"type": "string",
-										"description": "A brief description of the item. Remove any nonsensical or unnecessary words and normalize capitalization."
-									},
-									"cost": {
-										"type": "number",
-										"description": "Cost of the individual item."
-									},
-									"line_number": {
-										"type": "number",
-										"description": "The line number that you got this information from."
-									}
-								},
-								"required": [
-									"description",
-									"cost",
-									"line_number"
-								],
-								"additionalProperties": False
-							}
-						},
-						"subtotal": {
-							"type": "number",
-							"description": "Total cost of items before any additional charges."
-						},
-						"total": {
-							"type": "number",
-							"description": "Total amount due including any additional charges or taxes."
-						},
-						"payment_method": {
-							"type": "string",
-							"description": "Description of the payment method (network and card number if credit card), modality name otherwise"
-						}
-					},
-					"required": [
-						"items",
-						"subtotal",
-						"total"
-					],
-					"additionalProperties": False
-				}
-			}
-		}
-	)
-	try:
-		receipt_json = json.loads(res.choices[0].message.content)
-	except:
+	receipt_json = llm.parse_receipt(receipt_lines)
+	if not isinstance(receipt_json, dict):
 		return {
 			"success": False
 		}
@@ -488,7 +498,7 @@ def receipt_verify(data):
 
 def save_receipt(user_id, data, receipt_lines):
 	tax = round(data["total"] - data["subtotal"], 2)
-	receipt_id = db.create_receipt(user_id, data["date"], data["name"], data["merchant_address"] or "", data["merchant_website"] or "", data["payment_method"] or "", tax, receipt_verify(data))
+	receipt_id = db.create_receipt(user_id, data["date"], data["name"], data["merchant_address"] or "", data["merchant_website"] or "", data["payment_method"] or "", tax, not data.get("fallback", False) and receipt_verify(data))
 	for item in data["items"]:
 		receipt_line = receipt_lines[item["line_number"]]
 		db.create_receipt_item(receipt_id, item["description"], round(item["cost"], 2), receipt_line["left"], receipt_line["top"], receipt_line["right"], receipt_line["bottom"])